@@ -9,14 +9,23 @@ Date: 2026-01-05
 """
 
 import argparse
+import logging
+import multiprocessing
 import os
+import posixpath
 import sys
 import zipfile
+import zlib
 import tempfile
 import shutil
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from html import escape
 from pathlib import Path
-from typing import Optional, List, Tuple
-import xml.etree.ElementTree as ET
+from typing import TYPE_CHECKING, FrozenSet, Iterable, Iterator, Optional, List, Tuple
+from urllib.parse import urlsplit
+from urllib.request import url2pathname
 
 try:
     import ebooklib
@@ -25,136 +34,53 @@ except ImportError:
     print("Error: ebooklib is not installed. Install it with: pip install ebooklib")
     sys.exit(1)
 
-try:
-    from weasyprint import HTML, CSS
-    from weasyprint.text.fonts import FontConfiguration
-except ImportError:
-    print("Error: weasyprint is not installed. Install it with: pip install weasyprint")
-    sys.exit(1)
+# WeasyPrint is imported on first use, see _import_weasyprint()
+if TYPE_CHECKING:
+    from weasyprint import CSS
 
 try:
-    from bs4 import BeautifulSoup
+    import lxml.html
 except ImportError:
-    print("Error: beautifulsoup4 is not installed. Install it with: pip install beautifulsoup4")
+    print("Error: lxml is not installed. Install it with: pip install lxml")
     sys.exit(1)
 
+# EPUB content documents are UTF-8, so decode them as such when parsing.
+# Comments and processing instructions never reach the PDF, so the parser
+# drops them instead of building nodes we would only serialize again.
+HTML_PARSER = lxml.html.HTMLParser(encoding='utf-8', remove_comments=True, remove_pis=True)
 
-class EPUBConverter:
-    """Main converter class for EPUB to PDF conversion."""
-    
-    def __init__(self, verbose: bool = False, preserve_temp: bool = False):
-        self.verbose = verbose
-        self.preserve_temp = preserve_temp
-        self.temp_dir = None
-        
-    def log(self, message: str, level: str = "INFO"):
-        """Log messages if verbose mode is enabled."""
-        if self.verbose:
-            print(f"[{level}] {message}")
-    
-    def validate_epub(self, epub_path: str) -> bool:
-        """
-        Validate that the input file is a valid EPUB.
-        
-        Args:
-            epub_path: Path to the EPUB file
-            
-        Returns:
-            True if valid, False otherwise
-        """
-        self.log(f"Validating EPUB file: {epub_path}")
-        
-        # Check file exists
-        if not os.path.exists(epub_path):
-            print(f"Error: File not found: {epub_path}", file=sys.stderr)
-            return False
-        
-        # Check file extension
-        if not epub_path.lower().endswith('.epub'):
-            print(f"Error: File does not have .epub extension: {epub_path}", file=sys.stderr)
-            return False
-        
-        # Check if it's a valid zip file
-        if not zipfile.is_zipfile(epub_path):
-            print(f"Error: File is not a valid EPUB (not a zip archive): {epub_path}", file=sys.stderr)
-            return False
-        
-        # Try to open with ebooklib
-        try:
-            book = epub.read_epub(epub_path)
-            self.log("EPUB validation successful")
-            return True
-        except Exception as e:
-            print(f"Error: Failed to read EPUB file: {e}", file=sys.stderr)
-            return False
-    
-    def extract_metadata(self, book: epub.EpubBook) -> dict:
-        """
-        Extract metadata from EPUB.
-        
-        Args:
-            book: EpubBook object
-            
-        Returns:
-            Dictionary containing metadata
-        """
-        self.log("Extracting metadata")
-        
-        metadata = {
-            'title': book.get_metadata('DC', 'title'),
-            'author': book.get_metadata('DC', 'creator'),
-            'publisher': book.get_metadata('DC', 'publisher'),
-            'language': book.get_metadata('DC', 'language'),
-            'date': book.get_metadata('DC', 'date'),
-            'identifier': book.get_metadata('DC', 'identifier'),
-        }
-        
-        # Extract first value if multiple
-        for key in metadata:
-            if metadata[key] and isinstance(metadata[key], list) and len(metadata[key]) > 0:
-                metadata[key] = metadata[key][0][0] if isinstance(metadata[key][0], tuple) else metadata[key][0]
-            elif not metadata[key]:
-                metadata[key] = None
-        
-        self.log(f"Title: {metadata.get('title', 'Unknown')}")
-        self.log(f"Author: {metadata.get('author', 'Unknown')}")
-        
-        return metadata
-    
-    def get_page_size(self, page_size: str) -> Tuple[str, str]:
-        """
-        Get page dimensions for the given page size.
-        
-        Args:
-            page_size: Page size name (A4, Letter, Custom)
-            
-        Returns:
-            Tuple of (width, height) in CSS format
-        """
-        sizes = {
-            'A4': ('210mm', '297mm'),
-            'LETTER': ('8.5in', '11in'),
-            'A5': ('148mm', '210mm'),
-            'LEGAL': ('8.5in', '14in'),
-        }
-        
-        return sizes.get(page_size.upper(), sizes['A4'])
-    
-    def create_css(self, page_size: str = 'A4', margins: int = 20, font_size: int = 12) -> str:
-        """
-        Create CSS styling for the PDF.
-        
-        Args:
-            page_size: Page size (A4, Letter, etc.)
-            margins: Margin size in mm
-            font_size: Base font size in pt
-            
-        Returns:
-            CSS string
-        """
-        width, height = self.get_page_size(page_size)
-        
-        css = f"""
+# Books with fewer chapters than this are processed in-process; spinning up
+# worker processes costs more than it saves
+MIN_PARALLEL_CHAPTERS = 4
+
+# Tasks queued per worker process. Chapters are batched into chunks so each
+# worker gets about this many, which keeps IPC low while still balancing
+# chapters of uneven size.
+CHAPTER_TASKS_PER_WORKER = 4
+
+# Threads used to write images out for --preserve-temp
+IMAGE_WRITE_WORKERS = 8
+
+# Minimum seconds between verbose progress updates
+PROGRESS_INTERVAL = 0.1
+
+# Write buffer size for the assembled book.html
+HTML_WRITE_BUFFER = 1 << 20
+
+# Characters in a file name that are replaced with '_' in generated anchor IDs
+ANCHOR_ID_TABLE = str.maketrans({'/': '_', '.': '_', '#': '_'})
+
+# Page dimensions in CSS units, keyed by upper-case page size name
+PAGE_SIZES = {
+    'A4': ('210mm', '297mm'),
+    'LETTER': ('8.5in', '11in'),
+    'A5': ('148mm', '210mm'),
+    'LEGAL': ('8.5in', '14in'),
+}
+
+# Stylesheet for the generated PDF, filled in by EPUBConverter.create_css().
+# Rules for elements a book may not contain live in CSS_OPTIONAL_RULES.
+CSS_TEMPLATE = """
         @page {{
             size: {width} {height};
             margin: {margins}mm;
@@ -182,7 +108,7 @@ class EPUBConverter:
         
         h1 {{
             string-set: book-title content();
-            font-size: {font_size * 2}pt;
+            font-size: {h1_size}pt;
             font-weight: bold;
             margin-top: 1em;
             margin-bottom: 0.5em;
@@ -191,7 +117,7 @@ class EPUBConverter:
         }}
         
         h2 {{
-            font-size: {font_size * 1.5}pt;
+            font-size: {h2_size}pt;
             font-weight: bold;
             margin-top: 0.8em;
             margin-bottom: 0.4em;
@@ -199,7 +125,7 @@ class EPUBConverter:
         }}
         
         h3 {{
-            font-size: {font_size * 1.25}pt;
+            font-size: {h3_size}pt;
             font-weight: bold;
             margin-top: 0.6em;
             margin-bottom: 0.3em;
@@ -207,7 +133,7 @@ class EPUBConverter:
         }}
         
         h4, h5, h6 {{
-            font-size: {font_size * 1.1}pt;
+            font-size: {h4_size}pt;
             font-weight: bold;
             margin-top: 0.5em;
             margin-bottom: 0.25em;
@@ -226,6 +152,30 @@ class EPUBConverter:
             text-indent: 0;
         }}
         
+        ul, ol {{
+            margin: 0.5em 0;
+            padding-left: 2em;
+        }}
+        
+        li {{
+            margin: 0.25em 0;
+        }}
+        
+        a {{
+            color: #0066cc;
+            text-decoration: none;
+        }}
+        
+        .chapter {{
+            page-break-before: always;
+        }}
+"""
+
+# Rule blocks only emitted when their feature is present (see CSS_FEATURE_TAGS),
+# so WeasyPrint doesn't parse and match selectors for elements never used.
+# Kept in stylesheet order.
+CSS_OPTIONAL_RULES = {
+    'img': """
         img {{
             max-width: 100%;
             height: auto;
@@ -233,7 +183,8 @@ class EPUBConverter:
             margin: 1em auto;
             page-break-inside: avoid;
         }}
-        
+""",
+    'table': """
         table {{
             border-collapse: collapse;
             width: 100%;
@@ -251,23 +202,16 @@ class EPUBConverter:
             background-color: #f2f2f2;
             font-weight: bold;
         }}
-        
+""",
+    'blockquote': """
         blockquote {{
             margin: 1em 2em;
             padding: 0.5em 1em;
             border-left: 3px solid #ccc;
             font-style: italic;
         }}
-        
-        ul, ol {{
-            margin: 0.5em 0;
-            padding-left: 2em;
-        }}
-        
-        li {{
-            margin: 0.25em 0;
-        }}
-        
+""",
+    'code': """
         pre, code {{
             font-family: 'Courier New', monospace;
             background-color: #f5f5f5;
@@ -280,29 +224,22 @@ class EPUBConverter:
             overflow-x: auto;
             page-break-inside: avoid;
         }}
-        
-        a {{
-            color: #0066cc;
-            text-decoration: none;
-        }}
-        
+""",
+    'hr': """
         hr {{
             border: none;
             border-top: 1px solid #ccc;
             margin: 2em 0;
         }}
-        
-        .chapter {{
-            page-break-before: always;
-        }}
-        
+""",
+    'toc': """
         /* Table of Contents styling */
         .toc-page {{
             page-break-after: always;
         }}
         
         .toc-title {{
-            font-size: {font_size * 1.8}pt;
+            font-size: {toc_title_size}pt;
             font-weight: bold;
             text-align: center;
             margin-bottom: 1em;
@@ -341,10 +278,374 @@ class EPUBConverter:
         
         .toc-list a:hover {{
             color: #0066cc;
-        }}        """
+        }}
+""",
+}
+
+# Chapter elements that need one of the CSS_OPTIONAL_RULES blocks
+CSS_FEATURE_TAGS = {
+    'img': 'img',
+    'table': 'table',
+    'th': 'table',
+    'td': 'table',
+    'blockquote': 'blockquote',
+    'pre': 'code',
+    'code': 'code',
+    'hr': 'hr',
+}
+
+
+def _import_weasyprint():
+    """
+    Import WeasyPrint on first use.
+    
+    Loading it sets up Pango/Cairo, which is slow and not needed for
+    --help, --version or chapter worker processes.
+    
+    Returns:
+        The weasyprint module
+    """
+    try:
+        import weasyprint
+        import weasyprint.text.fonts
+    except ImportError:
+        print("Error: weasyprint is not installed. Install it with: pip install weasyprint")
+        sys.exit(1)
+    return weasyprint
+
+
+def _pool_size(workers: int) -> int:
+    """
+    Clamp a worker count to what ProcessPoolExecutor accepts on this platform.
+    
+    Args:
+        workers: Requested number of worker processes
+        
+    Returns:
+        Number of workers to pass as max_workers
+    """
+    if sys.platform == 'win32':
+        # Windows can't wait on more than 61 worker processes
+        return min(workers, 61)
+    return workers
+
+
+def _anchor_id(filename: str) -> str:
+    """
+    Build the TOC anchor ID for a document file name.
+    
+    Args:
+        filename: Document file name inside the EPUB (no '#' fragment)
+        
+    Returns:
+        Anchor ID usable in an HTML id attribute
+    """
+    stem, ext = posixpath.splitext(filename)
+    if ext in ('.xhtml', '.html'):
+        filename = stem
+    return filename.translate(ANCHOR_ID_TABLE)
+
+
+def _normalize_epub_path(path: str, base_path: str = "") -> str:
+    """
+    Resolve a path inside the EPUB to its canonical form.
+    
+    Used for both rewritten <img> src values and image index keys, so the
+    two always agree.
+    
+    Args:
+        path: Path or relative URL, possibly with backslashes
+        base_path: Directory to resolve a relative path against
+        
+    Returns:
+        Normalized path relative to the EPUB root
+    """
+    # Normalize stray backslashes first so the join understands them
+    path = posixpath.normpath(posixpath.join(base_path, path.replace('\\', '/')))
+    # Never point above the extraction root
+    while path.startswith('../'):
+        path = path[3:]
+    return path.lstrip('/')
+
+
+def _process_html_tree(html_content: bytes, base_path: str = "") -> lxml.html.HtmlElement:
+    """
+    Parse and clean HTML content.
+    
+    Args:
+        html_content: Raw HTML content
+        base_path: Directory of the document inside the EPUB, used to resolve
+            relative image URLs
+        
+    Returns:
+        Root element of the cleaned document, ready for further in-place edits
+    """
+    root = lxml.html.document_fromstring(html_content, parser=HTML_PARSER)
+    
+    # Remove script and style tags (drop_tree keeps any text that follows them)
+    for tag in list(root.iter('script', 'style')):
+        tag.drop_tree()
+    
+    # Fix image paths - images are extracted under their EPUB names and
+    # book.html sits at the root of that tree, so resolve each src against
+    # the document's directory (e.g. "../images/foo.jpg" in "text/ch1.xhtml"
+    # becomes "images/foo.jpg"). These are URL paths, hence posixpath.
+    for img in root.iter('img'):
+        src = img.get('src', '')
+        if src and not src.startswith(('http://', 'https://', 'data:')):
+            img.set('src', _normalize_epub_path(src, base_path))
+    
+    return root
+
+
+def _process_chapter(name: str, raw_bytes: bytes,
+                     anchor_id: Optional[str] = None) -> Tuple[str, FrozenSet[str]]:
+    """
+    Clean one EPUB document and return its body HTML.
+    
+    This is a module-level function so it can run in worker processes.
+    
+    Args:
+        name: Document file name inside the EPUB
+        raw_bytes: Raw document content
+        anchor_id: TOC anchor to place on the first heading, if any
+        
+    Returns:
+        Tuple of (html, css_features), where css_features names the
+        CSS_OPTIONAL_RULES blocks the document needs
+    """
+    root = _process_html_tree(raw_bytes, posixpath.dirname(name))
+    
+    # Extract body content
+    body = root.find('body')
+    if body is None:
+        features = frozenset(CSS_FEATURE_TAGS[el.tag] for el in root.iter(*CSS_FEATURE_TAGS))
+        return lxml.html.tostring(root, encoding='unicode'), features
+    
+    features = frozenset(CSS_FEATURE_TAGS[el.tag] for el in body.iter(*CSS_FEATURE_TAGS))
+    
+    first_heading = next(body.iter('h1', 'h2', 'h3'), None)
+    if first_heading is not None:
+        if anchor_id:
+            # Add anchor ID to first heading since this file is in the TOC
+            first_heading.set('id', anchor_id)
+        # Headings the book already styles only become chapters when linked
+        if anchor_id or first_heading.get('class') is None:
+            first_heading.classes.add('chapter')
+    
+    return lxml.html.tostring(body, encoding='unicode', with_tail=False), features
+
+
+def _try_process_chapter(
+    chapter: Tuple[str, bytes, Optional[str]]
+) -> Tuple[Optional[Tuple[str, FrozenSet[str]]], Optional[str]]:
+    """
+    Run _process_chapter() on a chapter tuple without raising.
+    
+    Failures are returned rather than raised so one bad chapter doesn't
+    abort a ProcessPoolExecutor.map() over the whole book.
+    
+    Args:
+        chapter: (name, raw_bytes, anchor_id) tuple
+        
+    Returns:
+        Tuple of ((html, css_features), None) on success, or (None, error message)
+    """
+    try:
+        return _process_chapter(*chapter), None
+    except Exception as e:
+        return None, str(e)
+
+
+class EPUBConverter:
+    """Main converter class for EPUB to PDF conversion."""
+    
+    def __init__(self, verbose: bool = False, preserve_temp: bool = False,
+                 max_workers: Optional[int] = None):
+        self.verbose = verbose
+        self.preserve_temp = preserve_temp
+        # Worker processes for chapter processing (None means one per CPU)
+        self.max_workers = max_workers
+        self.temp_dir = None
+        # Shared by every book this converter renders, so system fonts are
+        # scanned once per batch and compiled stylesheets can be reused
+        self._font_config = None
+        self._css_cache = {}
+        
+    def log(self, message: str, level: str = "INFO"):
+        """Log messages if verbose mode is enabled."""
+        if self.verbose:
+            print(f"[{level}] {message}")
+    
+    def validate_epub(self, epub_path: str) -> Optional[epub.EpubBook]:
+        """
+        Validate that the input file is a valid EPUB.
+        
+        Args:
+            epub_path: Path to the EPUB file
+            
+        Returns:
+            The loaded EpubBook if valid (so callers need not read it
+            again), None otherwise
+        """
+        self.log(f"Validating EPUB file: {epub_path}")
+        
+        # Check file exists
+        if not os.path.exists(epub_path):
+            print(f"Error: File not found: {epub_path}", file=sys.stderr)
+            return None
+        
+        # Check file extension
+        if not epub_path.lower().endswith('.epub'):
+            print(f"Error: File does not have .epub extension: {epub_path}", file=sys.stderr)
+            return None
+        
+        # Check it's a zip with the EPUB container layout, by peeking at the
+        # archive directory before paying for a full ebooklib parse
+        try:
+            with zipfile.ZipFile(epub_path) as zf:
+                names = set(zf.namelist())
+                if 'META-INF/container.xml' not in names:
+                    print(f"Error: File is not a valid EPUB (missing META-INF/container.xml): {epub_path}", file=sys.stderr)
+                    return None
+                # The mimetype entry is required by the spec but some tools omit
+                # it, so only reject files that declare something else
+                if 'mimetype' in names:
+                    try:
+                        mimetype = zf.read('mimetype')
+                    except (zipfile.BadZipFile, NotImplementedError, zlib.error):
+                        # Corrupt entry or unsupported compression method
+                        print(f"Error: File is not a valid EPUB (unreadable mimetype): {epub_path}", file=sys.stderr)
+                        return None
+                    if not mimetype.strip().startswith(b'application/epub+zip'):
+                        print(f"Error: File is not a valid EPUB (wrong mimetype): {epub_path}", file=sys.stderr)
+                        return None
+        except (zipfile.BadZipFile, OSError):
+            # OSError covers directories (e.g. unpacked Apple Books exports)
+            # and unreadable files
+            print(f"Error: File is not a valid EPUB (not a zip archive): {epub_path}", file=sys.stderr)
+            return None
+        
+        # Try to open with ebooklib
+        try:
+            book = epub.read_epub(epub_path)
+            self.log("EPUB validation successful")
+            return book
+        except Exception as e:
+            print(f"Error: Failed to read EPUB file: {e}", file=sys.stderr)
+            return None
+    
+    def extract_metadata(self, book: epub.EpubBook) -> dict:
+        """
+        Extract metadata from EPUB.
+        
+        Args:
+            book: EpubBook object
+            
+        Returns:
+            Dictionary containing metadata
+        """
+        self.log("Extracting metadata")
+        
+        metadata = {
+            'title': book.get_metadata('DC', 'title'),
+            'author': book.get_metadata('DC', 'creator'),
+            'publisher': book.get_metadata('DC', 'publisher'),
+            'language': book.get_metadata('DC', 'language'),
+            'date': book.get_metadata('DC', 'date'),
+            'identifier': book.get_metadata('DC', 'identifier'),
+        }
+        
+        # Extract first value if multiple
+        for key in metadata:
+            if metadata[key] and isinstance(metadata[key], list) and len(metadata[key]) > 0:
+                metadata[key] = metadata[key][0][0] if isinstance(metadata[key][0], tuple) else metadata[key][0]
+            elif not metadata[key]:
+                metadata[key] = None
+        
+        self.log(f"Title: {metadata.get('title', 'Unknown')}")
+        self.log(f"Author: {metadata.get('author', 'Unknown')}")
+        
+        return metadata
+    
+    def get_page_size(self, page_size: str) -> Tuple[str, str]:
+        """
+        Get page dimensions for the given page size.
+        
+        Args:
+            page_size: Page size name (A4, Letter, Custom)
+            
+        Returns:
+            Tuple of (width, height) in CSS format
+        """
+        return PAGE_SIZES.get(page_size.upper(), PAGE_SIZES['A4'])
+    
+    def create_css(self, page_size: str = 'A4', margins: int = 20, font_size: int = 12,
+                   features: Optional[Iterable[str]] = None) -> str:
+        """
+        Create CSS styling for the PDF.
+        
+        Args:
+            page_size: Page size (A4, Letter, etc.)
+            margins: Margin size in mm
+            font_size: Base font size in pt
+            features: Names of the CSS_OPTIONAL_RULES blocks to include
+                (default: all of them)
+            
+        Returns:
+            CSS string
+        """
+        width, height = self.get_page_size(page_size)
+        
+        template = CSS_TEMPLATE
+        for name, rules in CSS_OPTIONAL_RULES.items():
+            if features is None or name in features:
+                template += rules
+        
+        css = template.format(
+            width=width,
+            height=height,
+            margins=margins,
+            font_size=font_size,
+            h1_size=font_size * 2,
+            h2_size=font_size * 1.5,
+            h3_size=font_size * 1.25,
+            h4_size=font_size * 1.1,
+            toc_title_size=font_size * 1.8,
+        )
         
         return css
     
+    def _get_stylesheet(self, page_size: str, margins: int, font_size: int,
+                        features: Iterable[str]) -> 'CSS':
+        """
+        Get the compiled PDF stylesheet, reusing it across conversions.
+        
+        Args:
+            page_size: Page size (A4, Letter, etc.)
+            margins: Margin size in mm
+            font_size: Base font size in pt
+            features: Names of the CSS_OPTIONAL_RULES blocks the book needs
+            
+        Returns:
+            WeasyPrint CSS object
+        """
+        weasyprint = _import_weasyprint()
+        if self._font_config is None:
+            self._font_config = weasyprint.text.fonts.FontConfiguration()
+        
+        features = frozenset(features)
+        key = (page_size.upper(), margins, font_size, features)
+        css_obj = self._css_cache.get(key)
+        if css_obj is None:
+            self.log("Generating CSS...")
+            css_obj = weasyprint.CSS(
+                string=self.create_css(page_size, margins, font_size, features),
+                font_config=self._font_config
+            )
+            self._css_cache[key] = css_obj
+        return css_obj
+    
     def extract_toc(self, book: epub.EpubBook) -> List[Tuple[str, str, int]]:
         """
         Extract table of contents from EPUB.
@@ -357,27 +658,24 @@ class EPUBConverter:
         """
         toc_entries = []
         
-        def process_toc_item(item, level=1):
+        # Walk the TOC depth-first with an explicit stack of (item, level);
+        # children are pushed reversed so they come off in document order
+        stack = [(item, 1) for item in reversed(book.toc or [])]
+        while stack:
+            item, level = stack.pop()
             if isinstance(item, tuple):
                 # Item is (Section, list_of_children)
                 section, children = item
                 if hasattr(section, 'title') and hasattr(section, 'href'):
                     toc_entries.append((section.title, section.href, level))
-                for child in children:
-                    process_toc_item(child, level + 1)
-            elif isinstance(item, epub.Link):
+                stack.extend((child, level + 1) for child in reversed(children))
+            elif type(item) is epub.Link:
                 # Item is a Link object
                 toc_entries.append((item.title, item.href, level))
             elif hasattr(item, 'title') and hasattr(item, 'href'):
                 # Item has title and href attributes
                 toc_entries.append((item.title, item.href, level))
         
-        # Process the table of contents
-        toc = book.toc
-        if toc:
-            for item in toc:
-                process_toc_item(item)
-        
         self.log(f"Extracted {len(toc_entries)} TOC entries")
         return toc_entries
     
@@ -392,25 +690,103 @@ class EPUBConverter:
         Returns:
             Processed HTML string
         """
-        soup = BeautifulSoup(html_content, 'html.parser')
-        
-        # Remove script and style tags
-        for tag in soup.find_all(['script', 'style']):
-            tag.decompose()
-        
-        # Fix image paths - keep them relative to the HTML file location
-        # Images are extracted preserving their directory structure, so we just
-        # need to ensure the paths are clean and use forward slashes
-        for img in soup.find_all('img'):
-            src = img.get('src', '')
-            if src and not src.startswith(('http://', 'https://', 'data:')):
-                # Clean up the path - remove leading slashes and '../' patterns
-                # but keep the relative path structure (e.g., "images/foo.jpg")
-                clean_src = src.lstrip('./').lstrip('/')
-                # Normalize to forward slashes for web compatibility
-                img['src'] = clean_src.replace('\\', '/')
-        
-        return str(soup)
+        root = _process_html_tree(html_content.encode('utf-8'))
+        return lxml.html.tostring(root, encoding='unicode')
+    
+    def _make_url_fetcher(self, image_index: dict):
+        """
+        Build a WeasyPrint url_fetcher that serves EPUB images from memory.
+        
+        Args:
+            image_index: Mapping of image names (relative to temp_dir) to EPUB items
+            
+        Returns:
+            url_fetcher for weasyprint.HTML
+        """
+        temp_dir = self.temp_dir
+        weasyprint = _import_weasyprint()
+        
+        def lookup(url):
+            if url.startswith('file:'):
+                path = url2pathname(urlsplit(url).path)
+                return image_index.get(Path(os.path.relpath(path, temp_dir)).as_posix())
+            return None
+        
+        # WeasyPrint 66+ only accepts URLFetcher instances; older releases
+        # take a plain function returning a dict
+        if hasattr(weasyprint, 'URLFetcher'):
+            from weasyprint.urls import URLFetcherResponse
+            
+            class EPUBURLFetcher(weasyprint.URLFetcher):
+                def fetch(self, url, headers=None):
+                    item = lookup(url)
+                    if item is not None:
+                        return URLFetcherResponse(
+                            url, item.get_content(), {'Content-Type': item.media_type})
+                    # Anything else (remote URLs, data: URIs, missing files)
+                    # goes through WeasyPrint's own fetcher
+                    return super().fetch(url, headers)
+            
+            return EPUBURLFetcher()
+        
+        default_url_fetcher = weasyprint.default_url_fetcher
+        
+        def fetch(url, *args, **kwargs):
+            item = lookup(url)
+            if item is not None:
+                return {
+                    'string': item.get_content(),
+                    'mime_type': item.media_type,
+                    'redirected_url': url,
+                }
+            return default_url_fetcher(url, *args, **kwargs)
+        
+        return fetch
+    
+    def _process_chapters(
+        self,
+        chapters: List[Tuple[str, bytes, Optional[str]]]
+    ) -> Iterator[Optional[Tuple[str, FrozenSet[str]]]]:
+        """
+        Process chapters, spreading them over worker processes when worthwhile.
+        
+        Args:
+            chapters: List of (name, raw_bytes, anchor_id) tuples
+            
+        Yields:
+            (html, css_features) per chapter in reading order, or None for
+            chapters that failed
+        """
+        workers = _pool_size(self.max_workers or os.cpu_count() or 1)
+        chunksize = max(1, len(chapters) // (workers * CHAPTER_TASKS_PER_WORKER))
+        # The pool starts all its processes up front, so don't start more
+        # than there are chunks to hand out
+        workers = min(workers, -(-len(chapters) // chunksize))
+        
+        executor = None
+        # Daemonic processes (e.g. multiprocessing.Pool workers) may not start
+        # children, so callers running us inside one get in-process processing
+        if (len(chapters) >= MIN_PARALLEL_CHAPTERS and workers > 1
+                and not multiprocessing.current_process().daemon):
+            try:
+                executor = ProcessPoolExecutor(max_workers=workers)
+                results = executor.map(_try_process_chapter, chapters, chunksize=chunksize)
+            except (OSError, AssertionError, NotImplementedError) as e:
+                self.log(f"Warning: Could not start worker processes ({e}), processing chapters in-process", "WARN")
+                if executor is not None:
+                    executor.shutdown()
+                    executor = None
+        if executor is None:
+            results = map(_try_process_chapter, chapters)
+        
+        try:
+            for chapter, (result, error) in zip(chapters, results):
+                if error is not None:
+                    self.log(f"Warning: Failed to process item {chapter[0]}: {error}", "WARN")
+                yield result
+        finally:
+            if executor is not None:
+                executor.shutdown()
     
     def convert(
         self,
@@ -420,7 +796,9 @@ class EPUBConverter:
         margins: int = 20,
         font_size: int = 12,
         include_toc: bool = True,
-        preserve_temp: bool = None
+        preserve_temp: bool = None,
+        optimize_images: bool = False,
+        uncompressed_pdf: bool = False
     ) -> bool:
         """
         Convert EPUB to PDF.
@@ -433,12 +811,18 @@ class EPUBConverter:
             font_size: Base font size in pt
             include_toc: Include table of contents
             preserve_temp: Preserve temporary HTML files in temp_html folder
+            optimize_images: Let WeasyPrint optimize embedded images (smaller, slower)
+            uncompressed_pdf: Skip PDF stream compression (faster, larger)
             
         Returns:
             True if successful, False otherwise
         """
-        # Validate input
-        if not self.validate_epub(epub_path):
+        # Fail fast if the renderer is missing, before any real work
+        _import_weasyprint()
+        
+        # Validate input, keeping the parsed book for the conversion itself
+        book = self.validate_epub(epub_path)
+        if book is None:
             return False
         
         # Determine output path
@@ -448,11 +832,11 @@ class EPUBConverter:
         
         self.log(f"Output will be saved to: {output_path}")
         
+        # The logger is process-wide, so remember its level to restore after
+        weasyprint_logger = logging.getLogger('weasyprint')
+        previous_log_level = weasyprint_logger.level
+        
         try:
-            # Read EPUB
-            self.log("Reading EPUB file...")
-            book = epub.read_epub(epub_path)
-            
             # Extract metadata
             metadata = self.extract_metadata(book)
             
@@ -476,147 +860,161 @@ class EPUBConverter:
                 self.temp_dir = tempfile.mkdtemp()
                 self.log(f"Created temporary directory: {self.temp_dir}")
             
-            # Extract images first and build image map
-            self.log("Extracting images...")
-            image_map = {}
-            image_count = 0
-            
-            # Extract regular images
-            for item in book.get_items_of_type(ebooklib.ITEM_IMAGE):
-                img_name = item.get_name()
-                img_path = os.path.join(self.temp_dir, img_name)
-                os.makedirs(os.path.dirname(img_path), exist_ok=True)
-                with open(img_path, 'wb') as img_file:
-                    img_file.write(item.get_content())
-                # Store mapping of original path to extracted path
-                image_map[img_name] = img_path
-                # Also store without leading path components for flexibility
-                image_map[img_name.lstrip('./')] = img_path
-                image_count += 1
-            
-            # Also extract cover images (they have a different type)
-            for item in book.get_items_of_type(ebooklib.ITEM_COVER):
-                img_name = item.get_name()
-                img_path = os.path.join(self.temp_dir, img_name)
-                os.makedirs(os.path.dirname(img_path), exist_ok=True)
-                with open(img_path, 'wb') as img_file:
-                    img_file.write(item.get_content())
-                image_map[img_name] = img_path
-                image_map[img_name.lstrip('./')] = img_path
-                image_count += 1
-            
-            self.log(f"Extracted {image_count} images")
-            
-            # Build HTML content
-            self.log("Building HTML content...")
-            html_parts = ['<!DOCTYPE html><html><head><meta charset="utf-8">']
-            html_parts.append(f'<title>{metadata.get("title", "Converted Book")}</title>')
-            html_parts.append('</head><body>')
-            
-            # Add title page
-            if metadata.get('title'):
-                html_parts.append('<div class="title-page" style="text-align: center; padding: 5em 2em;">')
-                html_parts.append(f'<h1 style="font-size: 24pt; margin-bottom: 1em;">{metadata["title"]}</h1>')
-                if metadata.get('author'):
-                    html_parts.append(f'<p style="font-size: 14pt;">by {metadata["author"]}</p>')
-                if metadata.get('publisher'):
-                    html_parts.append(f'<p style="font-size: 12pt; margin-top: 2em;">{metadata["publisher"]}</p>')
-                html_parts.append('</div>')
-                html_parts.append('<div style="page-break-after: always;"></div>')
-            
-            # Add table of contents if requested and entries exist
-            if include_toc and toc_entries:
-                html_parts.append('<div class="toc-page">')
-                html_parts.append('<h2 class="toc-title">Table of Contents</h2>')
-                html_parts.append('<ul class="toc-list">')
-                for title, href, level in toc_entries:
-                    # Clean href to create an anchor ID
-                    anchor_id = href.replace('/', '_').replace('.', '_').replace('#', '_').replace('.xhtml', '').replace('.html', '')
-                    # Escape HTML entities in title
-                    from html import escape
-                    safe_title = escape(title)
-                    html_parts.append(f'<li class="toc-level-{level}"><a href="#{anchor_id}">{safe_title}</a></li>')
-                html_parts.append('</ul>')
-                html_parts.append('</div>')
-            
-            # Create mapping of file names to anchor IDs for linking
+            # Sort the manifest into images and documents in one pass rather
+            # than scanning it once per item type. Cover images have their
+            # own type, so they are indexed along with the other images.
+            image_items = []
+            document_items = []
+            for item in book.get_items():
+                item_type = item.get_type()
+                if item_type in (ebooklib.ITEM_IMAGE, ebooklib.ITEM_COVER):
+                    image_items.append(item)
+                elif item_type == ebooklib.ITEM_DOCUMENT:
+                    document_items.append(item)
+            
+            # Index images by their name inside the EPUB. WeasyPrint is served
+            # straight from this index, so images only need writing to disk
+            # when the temp folder is being kept for inspection.
+            self.log("Indexing images...")
+            # Keys are normalized like rewritten <img> src values so lookups
+            # always line up
+            image_index = {
+                _normalize_epub_path(item.get_name()): item
+                for item in image_items
+            }
+            
+            if preserve_temp:
+                img_paths = {
+                    img_name: os.path.join(self.temp_dir, img_name)
+                    for img_name in image_index
+                }
+                # Create each directory once up front rather than per image
+                for img_dir in {os.path.dirname(path) for path in img_paths.values()}:
+                    os.makedirs(img_dir, exist_ok=True)
+                
+                def write_image(img_name):
+                    Path(img_paths[img_name]).write_bytes(image_index[img_name].get_content())
+                
+                # File writes release the GIL, so overlap them across threads;
+                # list() re-raises any write error here
+                with ThreadPoolExecutor(max_workers=IMAGE_WRITE_WORKERS) as executor:
+                    list(executor.map(write_image, img_paths))
+            
+            self.log(f"Found {len(image_index)} images")
+            
+            # Create mapping of file names to anchor IDs for linking, and the
+            # TOC links themselves, in one pass over the entries. Every entry
+            # for a file links to the anchor on that file's first heading.
             anchor_map = {}
+            toc_links = []
             if include_toc and toc_entries:
                 for title, href, level in toc_entries:
                     # Extract filename from href (before any # anchor)
-                    filename = href.split('#')[0]
-                    anchor_id = href.replace('/', '_').replace('.', '_').replace('#', '_').replace('.xhtml', '').replace('.html', '')
-                    anchor_map[filename] = anchor_id
+                    filename = href.split('#', 1)[0]
+                    anchor_id = anchor_map.get(filename)
+                    if anchor_id is None:
+                        anchor_id = anchor_map[filename] = _anchor_id(filename)
+                    toc_links.append((title, anchor_id, level))
             
             # Process documents in reading order, but skip navigation/TOC documents
-            all_items = list(book.get_items_of_type(ebooklib.ITEM_DOCUMENT))
-            # Filter out navigation items (toc.xhtml, nav.xhtml, etc.) to avoid duplicate TOCs
-            # Check both the type and the class name since EpubNav items still have ITEM_DOCUMENT type
-            items = [item for item in all_items if type(item).__name__ != 'EpubNav']
-            total_items = len(items)
+            chapters = []
+            for item in document_items:
+                # Filter out navigation items (toc.xhtml, nav.xhtml, etc.) to avoid duplicate TOCs
+                # Check the class name since EpubNav items still have ITEM_DOCUMENT type
+                if type(item).__name__ == 'EpubNav':
+                    continue
+                item_name = item.get_name()
+                chapters.append((item_name, item.get_content(), anchor_map.get(item_name)))
+            total_items = len(chapters)
             
-            for idx, item in enumerate(items, 1):
-                if self.verbose:
-                    progress = (idx / total_items) * 100
-                    print(f"\rProcessing content: {progress:.1f}%", end='', flush=True)
+            # Build HTML content, writing each part straight to disk so the
+            # whole book never has to be held in memory
+            self.log("Building HTML content...")
+            html_file_path = os.path.join(self.temp_dir, 'book.html')
+            # Metadata is plain text; escape it once before it goes into markup
+            title_html = escape(metadata['title']) if metadata.get('title') else None
+            author_html = escape(metadata['author']) if metadata.get('author') else None
+            publisher_html = escape(metadata['publisher']) if metadata.get('publisher') else None
+            
+            # A large write buffer batches the many small writes into few syscalls
+            with open(html_file_path, 'w', encoding='utf-8', buffering=HTML_WRITE_BUFFER) as f:
+                f.write('<!DOCTYPE html><html><head><meta charset="utf-8">\n')
+                f.write(f'<title>{title_html or "Converted Book"}</title>\n')
+                f.write('</head><body>\n')
                 
-                try:
-                    content = item.get_content().decode('utf-8')
-                    processed_content = self.process_html_content(content, self.temp_dir)
-                    
-                    # Extract body content
-                    soup = BeautifulSoup(processed_content, 'html.parser')
-                    body = soup.find('body')
+                # Add title page
+                if title_html:
+                    f.write('<div class="title-page" style="text-align: center; padding: 5em 2em;">\n')
+                    f.write(f'<h1 style="font-size: 24pt; margin-bottom: 1em;">{title_html}</h1>\n')
+                    if author_html:
+                        f.write(f'<p style="font-size: 14pt;">by {author_html}</p>\n')
+                    if publisher_html:
+                        f.write(f'<p style="font-size: 12pt; margin-top: 2em;">{publisher_html}</p>\n')
+                    f.write('</div>\n')
+                    f.write('<div style="page-break-after: always;"></div>\n')
+                
+                # Optional CSS blocks the book actually needs
+                css_features = set()
+                
+                # Add table of contents if requested and entries exist
+                if include_toc and toc_entries:
+                    css_features.add('toc')
+                    f.write('<div class="toc-page">\n')
+                    f.write('<h2 class="toc-title">Table of Contents</h2>\n')
+                    f.write('<ul class="toc-list">\n')
+                    for title, anchor_id, level in toc_links:
+                        # Escape HTML entities in title
+                        safe_title = escape(title)
+                        f.write(f'<li class="toc-level-{level}"><a href="#{anchor_id}">{safe_title}</a></li>\n')
+                    f.write('</ul>\n')
+                    f.write('</div>\n')
+                
+                last_progress = 0.0
+                for idx, result in enumerate(self._process_chapters(chapters), 1):
+                    if self.verbose:
+                        # Redraw at most every PROGRESS_INTERVAL seconds, plus
+                        # once at the end, rather than flushing per chapter
+                        now = time.monotonic()
+                        if now - last_progress >= PROGRESS_INTERVAL or idx == total_items:
+                            progress = (idx / total_items) * 100
+                            print(f"\rProcessing content: {progress:.1f}%", end='', flush=True)
+                            last_progress = now
                     
-                    if body:
-                        # Add anchor ID to first heading if this file is in the TOC
-                        item_name = item.get_name()
-                        if include_toc and item_name in anchor_map:
-                            first_heading = body.find(['h1', 'h2', 'h3'])
-                            if first_heading:
-                                # Add anchor ID for TOC linking
-                                first_heading['id'] = anchor_map[item_name]
-                                # Add chapter class
-                                first_heading['class'] = first_heading.get('class', []) + ['chapter']
-                        else:
-                            # Just add chapter class to first heading if exists
-                            first_heading = body.find(['h1', 'h2', 'h3'])
-                            if first_heading and 'class' not in first_heading.attrs:
-                                first_heading['class'] = first_heading.get('class', []) + ['chapter']
-                        
-                        html_parts.append(str(body))
-                    else:
-                        html_parts.append(processed_content)
-                        
-                except Exception as e:
-                    self.log(f"Warning: Failed to process item {item.get_name()}: {e}", "WARN")
-            
-            if self.verbose:
-                print()  # New line after progress
-            
-            html_parts.append('</body></html>')
-            html_content = '\n'.join(html_parts)
-            
-            # Save HTML to temp file
-            html_file_path = os.path.join(self.temp_dir, 'book.html')
-            with open(html_file_path, 'w', encoding='utf-8') as f:
-                f.write(html_content)
+                    if result is not None:
+                        chapter_html, chapter_features = result
+                        f.write(chapter_html)
+                        f.write('\n')
+                        css_features |= chapter_features
+                
+                if self.verbose:
+                    print()  # New line after progress
+                
+                f.write('</body></html>\n')
             
             # Generate CSS
-            self.log("Generating CSS...")
-            css_content = self.create_css(page_size, margins, font_size)
+            css_obj = self._get_stylesheet(page_size, margins, font_size, css_features)
+            font_config = self._font_config
             
             # Convert to PDF
             self.log("Converting to PDF...")
-            font_config = FontConfiguration()
+            if not self.verbose:
+                # Don't build log records for WeasyPrint's per-element warnings
+                weasyprint_logger.setLevel(logging.ERROR)
             
-            html_obj = HTML(filename=html_file_path, base_url=self.temp_dir)
-            css_obj = CSS(string=css_content, font_config=font_config)
+            html_obj = _import_weasyprint().HTML(
+                filename=html_file_path,
+                base_url=self.temp_dir,
+                url_fetcher=self._make_url_fetcher(image_index)
+            )
             
             html_obj.write_pdf(
                 output_path,
                 stylesheets=[css_obj],
-                font_config=font_config
+                font_config=font_config,
+                # EPUB chapters are styled by our stylesheet, not HTML attributes
+                presentational_hints=False,
+                optimize_images=optimize_images,
+                uncompressed_pdf=uncompressed_pdf
             )
             
             self.log(f"PDF generated successfully: {output_path}")
@@ -636,6 +1034,8 @@ class EPUBConverter:
             return False
             
         finally:
+            weasyprint_logger.setLevel(previous_log_level)
+            
             # Clean up temp directory (unless preserve_temp is enabled)
             if preserve_temp is None:
                 preserve_temp = self.preserve_temp
@@ -670,18 +1070,82 @@ class EPUBConverter:
         total = len(epub_files)
         print(f"Starting batch conversion of {total} files...")
         
-        for idx, epub_path in enumerate(epub_files, 1):
-            print(f"\n[{idx}/{total}] Converting: {os.path.basename(epub_path)}")
-            
-            # Determine output path
+        # Determine output paths
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        jobs = []
+        for epub_path in epub_files:
             if output_dir:
-                os.makedirs(output_dir, exist_ok=True)
                 output_path = os.path.join(
                     output_dir,
                     Path(epub_path).stem + '.pdf'
                 )
             else:
                 output_path = None
+            jobs.append((epub_path, output_path))
+        
+        # Preserved temp files all go to the same temp_html folder, so those
+        # runs have to stay serial. So do runs inside a daemonic process,
+        # which may not start worker processes of its own.
+        preserve_temp = kwargs.get('preserve_temp')
+        if preserve_temp is None:
+            preserve_temp = self.preserve_temp
+        
+        if (total == 1 or preserve_temp or self.max_workers == 1
+                or multiprocessing.current_process().daemon):
+            parallel_jobs = []
+            serial_jobs = jobs
+        else:
+            # Inputs with the same stem share one PDF under output_dir. Two
+            # workers writing it at once could corrupt it, so those jobs run
+            # serially after the pool, in order, so the last input still wins
+            targets = [
+                os.path.normcase(os.path.abspath(output_path or Path(epub_path).with_suffix('.pdf')))
+                for epub_path, output_path in jobs
+            ]
+            target_counts = Counter(targets)
+            parallel_jobs = []
+            serial_jobs = []
+            for job, target in zip(jobs, targets):
+                if target_counts[target] > 1:
+                    serial_jobs.append(job)
+                else:
+                    parallel_jobs.append(job)
+            if serial_jobs:
+                print(f"Warning: {len(serial_jobs)} files share an output path, converting them one at a time",
+                      file=sys.stderr)
+        
+        done = 0
+        if parallel_jobs:
+            workers = _pool_size(min(len(parallel_jobs), self.max_workers or os.cpu_count() or 1))
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_batch_worker,
+                initargs=(self.verbose, self.preserve_temp)
+            ) as executor:
+                futures = {
+                    executor.submit(_convert_one, epub_path, output_path, kwargs): epub_path
+                    for epub_path, output_path in parallel_jobs
+                }
+                for future in as_completed(futures):
+                    done += 1
+                    epub_path = futures[future]
+                    try:
+                        success = future.result()
+                    except Exception as e:
+                        print(f"Error during conversion: {e}", file=sys.stderr)
+                        success = False
+                    
+                    status = "Converted" if success else "Failed"
+                    print(f"[{done}/{total}] {status}: {os.path.basename(epub_path)}")
+                    if success:
+                        successful += 1
+                    else:
+                        failed += 1
+        
+        for epub_path, output_path in serial_jobs:
+            done += 1
+            print(f"\n[{done}/{total}] Converting: {os.path.basename(epub_path)}")
             
             # Convert
             if self.convert(epub_path, output_path, **kwargs):
@@ -698,6 +1162,22 @@ class EPUBConverter:
         return successful, failed
 
 
+# Converter used inside batch worker processes, created once per process
+_batch_converter = None
+
+
+def _init_batch_worker(verbose: bool, preserve_temp: bool):
+    """Create the converter for a batch worker process."""
+    global _batch_converter
+    # Each book already has a process to itself, so process its chapters serially
+    _batch_converter = EPUBConverter(verbose=verbose, preserve_temp=preserve_temp, max_workers=1)
+
+
+def _convert_one(epub_path: str, output_path: Optional[str], kwargs: dict) -> bool:
+    """Convert a single EPUB inside a batch worker process."""
+    return _batch_converter.convert(epub_path, output_path, **kwargs)
+
+
 def main():
     """Main entry point for the script."""
     parser = argparse.ArgumentParser(
@@ -765,6 +1245,18 @@ Examples:
         help='Disable table of contents generation'
     )
     
+    parser.add_argument(
+        '--optimize-images',
+        action='store_true',
+        help='Optimize embedded images for a smaller PDF (slower)'
+    )
+    
+    parser.add_argument(
+        '--uncompressed-pdf',
+        action='store_true',
+        help='Write an uncompressed PDF (faster, larger file)'
+    )
+    
     parser.add_argument(
         '-v', '--verbose',
         action='store_true',
@@ -797,7 +1289,9 @@ Examples:
             page_size=args.page_size,
             margins=args.margins,
             font_size=args.font_size,
-            include_toc=not args.no_toc
+            include_toc=not args.no_toc,
+            optimize_images=args.optimize_images,
+            uncompressed_pdf=args.uncompressed_pdf
         )
     else:
         # Single file mode
@@ -807,7 +1301,9 @@ Examples:
             page_size=args.page_size,
             margins=args.margins,
             font_size=args.font_size,
-            include_toc=not args.no_toc
+            include_toc=not args.no_toc,
+            optimize_images=args.optimize_images,
+            uncompressed_pdf=args.uncompressed_pdf
         )
         
         sys.exit(0 if success else 1)